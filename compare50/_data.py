@@ -7,6 +7,7 @@ import numbers
 import attr
 import pygments
 import pygments.lexers
+import pygments.lexers.special
 
 
 __all__ = ["Pass", "Comparator", "File", "Submission",
@@ -161,6 +162,8 @@ class File:
     Represents a single file from a submission.
     """
     _lexer_cache = {}
+    # Names of files for which pygments has no lexer (a miss scans every lexer it knows of)
+    _lexer_misses = set()
     _store = IdStore(key=lambda file: file.path)
 
     name = attr.ib(converter=pathlib.Path, cmp=False)
@@ -183,22 +186,28 @@ class File:
 
     def lexer(self):
         """Determine which Pygments lexer should be used."""
-        ext = self.name.suffix
+        # Files without an extension (e.g. Makefile) are looked up by their full name
+        ext = self.name.suffix or self.name.name
         try:
             return self._lexer_cache[ext]
         except KeyError:
             pass
 
-        # get lexer for this file type
-        try:
-            lexer = pygments.lexers.get_lexer_for_filename(self.name.name)
-            self._lexer_cache[ext] = lexer
-            return lexer
-        except pygments.util.ClassNotFound:
+        # get lexer for this file type. Pygments matches on the full name
+        # (e.g. Makefile.in), so misses are remembered per name, not per extension
+        name = self.name.name
+        if name not in self._lexer_misses:
             try:
-                return pygments.lexers.guess_lexer(self.read())
+                lexer = pygments.lexers.get_lexer_for_filename(name)
+                self._lexer_cache[ext] = lexer
+                return lexer
             except pygments.util.ClassNotFound:
-                return pygments.lexers.special.TextLexer()
+                self._lexer_misses.add(name)
+
+        try:
+            return pygments.lexers.guess_lexer(self.read())
+        except pygments.util.ClassNotFound:
+            return pygments.lexers.special.TextLexer()
 
     @classmethod
     def get(cls, id):
@@ -1,4 +1,6 @@
 import collections
+import concurrent.futures
+import functools
 import glob
 import os
 import pathlib
@@ -8,8 +10,6 @@ import csv
 
 import attr
 import jinja2
-import pygments
-from pygments.formatters import HtmlFormatter
 
 from .. import _api
 from .._data import IdStore
@@ -17,10 +17,35 @@ from .._data import IdStore
 STATIC = pathlib.Path(pkg_resources.resource_filename("compare50._renderer", "static"))
 TEMPLATES = pathlib.Path(pkg_resources.resource_filename("compare50._renderer", "templates"))
 
+# Templates never change during a run, so compile each one once (per process) and reuse it
+_ENV = jinja2.Environment(loader=jinja2.FileSystemLoader(str(TEMPLATES)),
+                          autoescape=jinja2.select_autoescape(enabled_extensions=("html",)),
+                          auto_reload=False)
+
+# Match pages are large, so write them through a 1 MiB buffer
+_WRITE_BUFFER_SIZE = 1 << 20
+
+# Number of chunks of matches handed to each render worker
+_CHUNKS_PER_WORKER = 4
+
+# Every static file that is inlined into the pages
+_STATIC_FILES = ("bootstrap.min.css", "fonts.css", "match.css", "index.css",
+                 "split.min.js", "match.js", "d3.v4.min.js", "d3-scale-chromatic.v1.min.js",
+                 "d3-simple-slider.js", "index.js")
+
+
+def _percentage(num_chars_matched, num_chars):
+    return round(num_chars_matched / num_chars * 100) if num_chars else 0
+
+
 @attr.s(slots=True)
 class Fragment:
-    content = attr.ib(converter=lambda c: tuple(c.splitlines(True)))
-    spans = attr.ib(default=attr.Factory(tuple), converter=tuple)
+    # Many fragments are created per file, so keep attributes free of converters
+    # and factories: spans must be a tuple, span_ids the frozenset of their ids
+    content = attr.ib()
+    spans = attr.ib()
+    length = attr.ib()
+    span_ids = attr.ib()
 
 
 @attr.s(slots=True)
@@ -37,6 +62,11 @@ class HTMLFragment:
     is_ignored = attr.ib()
     is_grouped = attr.ib()
     spans = attr.ib()
+    length = attr.ib()
+
+    @property
+    def lines(self):
+        return self.content.splitlines(True)
 
 
 @attr.s(slots=True)
@@ -45,13 +75,10 @@ class HTMLFile:
     fragments = attr.ib()
     num_chars_matched = attr.ib()
     num_chars = attr.ib()
+    percentage = attr.ib(init=False)
 
-    @property
-    def percentage(self):
-        try:
-            return round(self.num_chars_matched / self.num_chars * 100)
-        except ZeroDivisionError:
-            return 0
+    def __attrs_post_init__(self):
+        self.percentage = _percentage(self.num_chars_matched, self.num_chars)
 
 
 @attr.s(slots=True)
@@ -60,13 +87,10 @@ class HTMLSubmission:
     files = attr.ib()
     num_chars_matched = attr.ib()
     num_chars = attr.ib()
+    percentage = attr.ib(init=False)
 
-    @property
-    def percentage(self):
-        try:
-            return round(self.num_chars_matched / self.num_chars * 100)
-        except ZeroDivisionError:
-            return 0
+    def __attrs_post_init__(self):
+        self.percentage = _percentage(self.num_chars_matched, self.num_chars)
 
 
 def render(pass_to_results, dest):
@@ -83,23 +107,24 @@ def render(pass_to_results, dest):
     results_per_sub_pair = sorted(sub_pair_to_results.values(),
                                   key=lambda res: res[0].score, reverse=True)
 
-    common_css = [read_file(STATIC / f) for f in  ("bootstrap.min.css", "fonts.css")]
-    match_css = common_css + [read_file(STATIC / "match.css")]
-    match_js = [read_file(STATIC / f) for f in ("split.min.js", "match.js")]
+    # Load static files
+    static = _read_static_files()
+    common_css = [static[f] for f in ("bootstrap.min.css", "fonts.css")]
+    match_css = common_css + [static["match.css"]]
+    match_js = [static[f] for f in ("split.min.js", "match.js")]
     # Render all matches
     with _api.Executor() as executor:
-        # Load static files
         max_id = len(results_per_sub_pair)
-        for id, html in executor.map(_RenderTask(dest, max_id, match_js, match_css), enumerate(results_per_sub_pair, 1)):
-            with open(dest / f"match_{id}.html", "w") as f:
-                f.write(html)
+        # Hand each worker several matches at a time, so the task (and the static
+        # files it carries) is pickled once per chunk rather than once per match
+        chunksize = max(1, max_id // ((os.cpu_count() or 1) * _CHUNKS_PER_WORKER))
+        for _ in executor.map(_RenderTask(dest, max_id, match_js, match_css),
+                              enumerate(results_per_sub_pair, 1), chunksize=chunksize):
             bar.update()
 
 
     # Create index
-    with open(TEMPLATES / "index.html") as f:
-        index_template = jinja2.Template(
-            f.read(), autoescape=jinja2.select_autoescape(enabled_extensions=("html",)))
+    index_template = _ENV.get_template("index.html")
 
     ranking_pass, ranking_results = next(iter(pass_to_results.items()))
 
@@ -121,8 +146,8 @@ def render(pass_to_results, dest):
         graph_info["nodes"].append({"id": str(sub.path)})
         graph_info["data"][str(sub.path)] = {"is_archive": sub.is_archive}
 
-    index_css = common_css + [read_file(STATIC / "index.css")]
-    index_js = [read_file(STATIC / f) for f in ("d3.v4.min.js", "d3-scale-chromatic.v1.min.js", "d3-simple-slider.js", "index.js")]
+    index_css = common_css + [static["index.css"]]
+    index_js = [static[f] for f in ("d3.v4.min.js", "d3-scale-chromatic.v1.min.js", "d3-simple-slider.js", "index.js")]
     # Render index
     rendered_index = index_template.render(js=index_js,
                                            css=index_css,
@@ -147,11 +172,22 @@ def render(pass_to_results, dest):
     return dest / "index.html"
 
 
-def fragmentize(file, spans):
+def fragmentize(file, spans, content=None, interned=False):
+    """
+    Slice ``file`` into fragments at the boundaries of ``spans``. The slicer tells
+    spans apart by identity, so equal spans are merged first unless ``interned``
+    says the caller already made equal spans the same object.
+    """
+    if not interned:
+        unique_spans = {}
+        for span in spans:
+            unique_spans.setdefault((span.file.id, span.start, span.end), span)
+        spans = unique_spans.values()
+
     slicer = _FragmentSlicer()
     for span in spans:
         slicer.add_span(span)
-    return slicer.slice(file)
+    return slicer.slice(file.read() if content is None else content)
 
 
 def read_file(fname):
@@ -159,6 +195,16 @@ def read_file(fname):
         return f.read()
 
 
+@functools.lru_cache(maxsize=None)
+def _read_static_files():
+    """
+    Read all static files concurrently, returning a mapping from name to content.
+    Static files never change, so this only happens once per process.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(_STATIC_FILES)) as pool:
+        return dict(zip(_STATIC_FILES, pool.map(read_file, (STATIC / name for name in _STATIC_FILES))))
+
+
 class _RenderTask:
     def __init__(self, dest, max_id, js, css):
         dest.mkdir(exist_ok=True)
@@ -168,50 +214,62 @@ class _RenderTask:
         self.css = css
 
     def __call__(self, arg):
-        id, results = arg
+        match_id, results = arg
         data = []
         match_htmls = []
 
+        match_template = _ENV.get_template("match.html")
+        page_template = _ENV.get_template("match_page.html")
+
+        # Every pass renders the same two submissions, so read each file only once
+        file_contents = {}
+
         for result in results:
-            renderer = _Renderer(result.name)
+            renderer = _Renderer(result.name, file_contents)
             score = result.score
             groups = result.groups
             ignored_spans = result.ignored_spans
 
-            file_to_spans = collections.defaultdict(list)
+            # Spans per file, keyed by file id to avoid hashing File objects
+            file_to_spans = {}
 
             for group in groups:
                 for span in group.spans:
-                    file_to_spans[span.file].append(span)
+                    span = renderer.intern_span(span)
+                    file_to_spans.setdefault(span.file.id, []).append(span)
 
+            ignored_span_ids = set()
             for span in ignored_spans:
-                file_to_spans[span.file].append(span)
+                span = renderer.intern_span(span)
+                file_to_spans.setdefault(span.file.id, []).append(span)
+                ignored_span_ids.add(id(span))
 
-            ignored_spans = set(ignored_spans)
-            sub_a = renderer.html_submission(score.sub_a, file_to_spans, ignored_spans)
-            sub_b = renderer.html_submission(score.sub_b, file_to_spans, ignored_spans)
+            sub_a = renderer.html_submission(score.sub_a, file_to_spans, ignored_span_ids)
+            sub_b = renderer.html_submission(score.sub_b, file_to_spans, ignored_span_ids)
 
             all_html_fragments = [frag for file in sub_a.files +
                                   sub_b.files for frag in file.fragments]
-            data.append(renderer.data(result, all_html_fragments, ignored_spans))
+            data.append(renderer.data(result, all_html_fragments, ignored_span_ids))
 
-            match_content = read_file(TEMPLATES / "match.html")
-            match_template = jinja2.Template(
-                match_content, autoescape=jinja2.select_autoescape(enabled_extensions=("html",)))
             match_html = match_template.render(name=result.name, sub_a=sub_a, sub_b=sub_b)
             match_htmls.append(match_html)
 
         passes = [result.pass_ for result in results]
 
-        page_content = read_file(TEMPLATES / "match_page.html")
-        page_template = jinja2.Template(
-            page_content, autoescape=jinja2.select_autoescape(enabled_extensions=("html",)))
-        page_html = page_template.render(id=id, max_id=self.max_id,
-                                         passes=passes, matches=match_htmls,
-                                         data=[attr.asdict(datum) for datum in data],
-                                         js=self.js, css=self.css)
+        # Serialize data here rather than through the template's tojson filter, shallowly
+        # (the values are already plain dicts) and without whitespace. Keys are sorted,
+        # as tojson does, so that output doesn't depend on the order dicts were built in
+        data_json = jinja2.utils.htmlsafe_json_dumps([attr.asdict(datum, recurse=False) for datum in data],
+                                                     sort_keys=True, separators=(",", ":"))
+
+        # Write the page from the worker so that disk I/O overlaps with other renders,
+        # streaming it to disk instead of building the whole page in memory first
+        with open(self.dest / f"match_{match_id}.html", "w", buffering=_WRITE_BUFFER_SIZE) as f:
+            page_template.stream(id=match_id, max_id=self.max_id,
+                                 passes=passes, matches=match_htmls,
+                                 data=data_json, js=self.js, css=self.css).dump(f)
 
-        return id, page_html
+        return match_id
 
     @staticmethod
     def _prepare_dest(dest):
@@ -236,10 +294,13 @@ class _RenderTask:
 
 
 class _Renderer:
-    def __init__(self, name):
+    def __init__(self, name, file_contents=None):
         self.name = name
+        self._file_contents = {} if file_contents is None else file_contents
         self._frag_id_counter = -1
-        self._span_id_store = IdStore()
+        self._spans = {}
+        # Spans are interned, so identity is enough to tell them apart
+        self._span_id_store = IdStore(key=id)
         self._group_id_store = IdStore()
 
     def frag_id(self, frag):
@@ -252,28 +313,42 @@ class _Renderer:
     def span_id(self, span):
         return self._span_id_store[span]
 
-    def html_fragments(self, file, spans, ignored_spans):
+    def intern_span(self, span):
+        """
+        Return the canonical object for ``span``, so that within this renderer
+        equal spans are always the same object and can be compared by ``id``.
+        """
+        return self._spans.setdefault((span.file.id, span.start, span.end), span)
+
+    def read(self, file):
+        try:
+            return self._file_contents[file.id]
+        except KeyError:
+            content = self._file_contents[file.id] = file.read()
+            return content
+
+    def html_fragments(self, file, spans, ignored_span_ids):
         frags = []
-        for fragment in fragmentize(file, spans):
+        for fragment in fragmentize(file, spans, self.read(file), interned=True):
             frag_id = self.frag_id(fragment)
-            is_ignored = any(span in ignored_spans for span in fragment.spans)
-            is_grouped = any(span not in ignored_spans for span in fragment.spans)
+            is_ignored = not fragment.span_ids.isdisjoint(ignored_span_ids)
+            is_grouped = not fragment.span_ids.issubset(ignored_span_ids)
             frags.append(HTMLFragment(frag_id, fragment.content,
-                                       is_ignored, is_grouped, fragment.spans))
+                                       is_ignored, is_grouped, fragment.spans, fragment.length))
         return frags
 
-    def html_files(self, submission, file_to_spans, ignored_spans):
+    def html_files(self, submission, file_to_spans, ignored_span_ids):
         files = []
         for file in submission.files:
-            spans = file_to_spans[file]
-            html_frags = self.html_fragments(file, spans, ignored_spans)
+            spans = file_to_spans.get(file.id, ())
+            html_frags = self.html_fragments(file, spans, ignored_span_ids)
 
             # Count number of chars
             num_chars = 0
             num_chars_matched = 0
             for frag in html_frags:
                 if not frag.is_ignored:
-                    num_frag_chars = sum(len(line) for line in frag.content)
+                    num_frag_chars = frag.length
                     num_chars += num_frag_chars
                     if frag.is_grouped:
                         num_chars_matched += num_frag_chars
@@ -281,24 +356,24 @@ class _Renderer:
             files.append(HTMLFile(file.name, html_frags, num_chars_matched, num_chars))
         return files
 
-    def html_submission(self, submission, file_to_spans, ignored_spans):
-        html_files = self.html_files(submission, file_to_spans, ignored_spans)
+    def html_submission(self, submission, file_to_spans, ignored_span_ids):
+        html_files = self.html_files(submission, file_to_spans, ignored_span_ids)
         num_chars_matched = sum(f.num_chars_matched for f in html_files)
         num_chars = sum(f.num_chars for f in html_files)
         return HTMLSubmission(submission.path, html_files, num_chars_matched, num_chars)
 
-    def data(self, result, html_fragments, ignored_spans):
+    def data(self, result, html_fragments, ignored_span_ids):
         fragment_to_spans = {}
         for fragment in html_fragments:
             if fragment.is_grouped:
                 fragment_to_spans[fragment.id] = [self.span_id(
-                    span) for span in fragment.spans if span not in ignored_spans]
+                    span) for span in fragment.spans if id(span) not in ignored_span_ids]
 
         span_to_group = {}
         for group in result.groups:
             group_id = self.group_id(group)
             for span in group.spans:
-                span_to_group[self.span_id(span)] = group_id
+                span_to_group[self.span_id(self.intern_span(span))] = group_id
 
         return Data(result.name, span_to_group, fragment_to_spans)
 
@@ -306,42 +381,44 @@ class _Renderer:
 class _FragmentSlicer:
     def __init__(self):
         self._slicing_marks = set()
-        self._start_to_spans = collections.defaultdict(set)
-        self._end_to_spans = collections.defaultdict(set)
+        self._start_to_spans = collections.defaultdict(list)
+        self._end_to_spans = collections.defaultdict(list)
+        self._span_lengths = {}
 
-    def slice(self, file):
+    def slice(self, content):
         # Slicing at 0 has no effect, so remove
         self._slicing_marks.discard(0)
 
-        # Get file content
-        with open(file.path) as f:
-            content = f.read()
-
         # If there are no slicing marks, return entire file in one fragment
         if not self._slicing_marks:
-            return [Fragment(content)]
+            return [Fragment(content, (), len(content), frozenset())]
 
         # Perform slicing in order
         slicing_marks = sorted(self._slicing_marks)
 
-        # Create list of spans at every fragment
-        spans = [self._start_to_spans[0] - self._end_to_spans[0]]
-        for mark in slicing_marks:
-            cur = set(spans[-1])
-            cur |= self._start_to_spans[mark]
-            cur -= self._end_to_spans[mark]
-            spans.append(cur)
-
         # Make sure that last slice ends at the last index in file
         if slicing_marks and slicing_marks[-1] < len(content):
             slicing_marks.append(len(content))
 
-        # Split fragments from file
+        # Split fragments from file, keeping track of the spans that are live
+        # at the start of every fragment in a single running mapping from id to span
+        # (the bucket lookups are bound up front, as this loop runs once per fragment)
+        starting_spans = self._start_to_spans.get
+        ending_spans = self._end_to_spans.get
+        span_length = self._span_lengths.__getitem__
         fragments = []
+        cur = {}
         start_mark = 0
-        for fragment_spans, mark in zip(spans, slicing_marks):
-            fragments.append(Fragment(content[start_mark:mark], sorted(
-                fragment_spans, key=lambda span: span.end - span.start, reverse=True)))
+        for mark in slicing_marks:
+            for span in starting_spans(start_mark, ()):
+                cur[id(span)] = span
+            for span in ending_spans(start_mark, ()):
+                cur.pop(id(span), None)
+            fragment_content = content[start_mark:mark]
+            # Order spans from longest to shortest
+            span_ids = sorted(cur, key=span_length, reverse=True)
+            fragments.append(Fragment(fragment_content, tuple(map(cur.__getitem__, span_ids)),
+                                      len(fragment_content), frozenset(span_ids)))
             start_mark = mark
 
         return fragments
@@ -349,5 +426,6 @@ class _FragmentSlicer:
     def add_span(self, span):
         self._slicing_marks.add(span.start)
         self._slicing_marks.add(span.end)
-        self._start_to_spans[span.start].add(span)
-        self._end_to_spans[span.end].add(span)
+        self._start_to_spans[span.start].append(span)
+        self._end_to_spans[span.end].append(span)
+        self._span_lengths[id(span)] = span.end - span.start
@@ -0,0 +1,70 @@
+import unittest
+import unittest.mock
+import tempfile
+import os
+
+import pygments.lexers
+import pygments.util
+
+import compare50._data as data
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.working_directory = tempfile.TemporaryDirectory()
+        self._wd = os.getcwd()
+        os.chdir(self.working_directory.name)
+
+        # Start every test with an empty lexer cache
+        for patcher in (unittest.mock.patch.dict(data.File._lexer_cache, clear=True),
+                        unittest.mock.patch.object(data.File, "_lexer_misses", set())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.working_directory.cleanup()
+        os.chdir(self._wd)
+
+    def file(self, name, content=""):
+        with open(name, "w") as f:
+            f.write(content)
+        return data.Submission(".", [name]).files[0]
+
+
+class TestLexer(TestCase):
+    def test_extensionless_files_get_own_lexer(self):
+        makefile = self.file("Makefile")
+        dockerfile = self.file("Dockerfile")
+        self.assertIsInstance(makefile.lexer(), pygments.lexers.MakefileLexer)
+        self.assertIsInstance(dockerfile.lexer(), pygments.lexers.DockerLexer)
+
+    def test_cached_miss_still_guesses(self):
+        file_a = self.file("foo.zzz", "foo")
+        file_b = self.file("bar.zzz", "bar")
+        guessed_lexer = pygments.lexers.PythonLexer()
+
+        with unittest.mock.patch("pygments.lexers.guess_lexer", return_value=guessed_lexer) as guess_lexer:
+            self.assertIs(file_a.lexer(), guessed_lexer)
+            self.assertIn("foo.zzz", data.File._lexer_misses)
+            self.assertIs(file_b.lexer(), guessed_lexer)
+
+        self.assertEqual([args for args, _ in guess_lexer.call_args_list], [("foo",), ("bar",)])
+
+    def test_suffix_miss_then_full_name_hit(self):
+        configure = self.file("configure.in", "AC_INIT([foo], [1.0])\n")
+        makefile = self.file("Makefile.in", "all:\n\techo foo\n")
+        with unittest.mock.patch("pygments.lexers.guess_lexer",
+                                 return_value=pygments.lexers.special.TextLexer()):
+            configure.lexer()
+        self.assertIsInstance(makefile.lexer(), pygments.lexers.MakefileLexer)
+
+    def test_cached_miss_falls_back_to_text_lexer(self):
+        file_a = self.file("foo.zzz")
+        file_b = self.file("bar.zzz")
+
+        with unittest.mock.patch("pygments.lexers.guess_lexer", side_effect=pygments.util.ClassNotFound):
+            self.assertIsInstance(file_a.lexer(), pygments.lexers.special.TextLexer)
+            self.assertIsInstance(file_b.lexer(), pygments.lexers.special.TextLexer)
+
+
+if __name__ == '__main__':
+    unittest.main()
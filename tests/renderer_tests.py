@@ -0,0 +1,94 @@
+import unittest
+import tempfile
+import os
+
+import compare50._data as data
+import compare50._renderer._renderer as renderer
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.working_directory = tempfile.TemporaryDirectory()
+        self._wd = os.getcwd()
+        os.chdir(self.working_directory.name)
+
+        self.content = "def bar():\n"\
+                       "    print('qux')\n"
+
+        with open("foo.py", "w") as f:
+            f.write(self.content)
+
+        self.file = data.Submission(".", ["foo.py"]).files[0]
+
+    def tearDown(self):
+        self.working_directory.cleanup()
+        os.chdir(self._wd)
+
+    def span(self, start, end):
+        return data.Span(self.file, start, end)
+
+
+class TestFragmentize(TestCase):
+    def test_no_spans(self):
+        fragments = renderer.fragmentize(self.file, [])
+        self.assertEqual(len(fragments), 1)
+        self.assertEqual(fragments[0].content, self.content)
+        self.assertEqual(fragments[0].spans, ())
+        self.assertEqual(fragments[0].length, len(self.content))
+
+    def test_single_span(self):
+        span = self.span(4, 7)
+        fragments = renderer.fragmentize(self.file, [span])
+        self.assertEqual([frag.content for frag in fragments],
+                         [self.content[:4], self.content[4:7], self.content[7:]])
+        self.assertEqual([frag.spans for frag in fragments], [(), (span,), ()])
+
+    def test_span_at_start_and_end(self):
+        span = self.span(0, len(self.content))
+        fragments = renderer.fragmentize(self.file, [span])
+        self.assertEqual(len(fragments), 1)
+        self.assertEqual(fragments[0].content, self.content)
+        self.assertEqual(fragments[0].spans, (span,))
+
+    def test_overlapping_spans(self):
+        span_1 = self.span(0, 10)
+        span_2 = self.span(5, 20)
+        fragments = renderer.fragmentize(self.file, [span_1, span_2])
+        self.assertEqual([frag.content for frag in fragments],
+                         [self.content[:5], self.content[5:10],
+                          self.content[10:20], self.content[20:]])
+        self.assertEqual([frag.length for frag in fragments], [5, 5, 10, len(self.content) - 20])
+        # Spans are ordered from longest to shortest
+        self.assertEqual([frag.spans for frag in fragments],
+                         [(span_1,), (span_2, span_1), (span_2,), ()])
+
+    def test_nested_spans(self):
+        outer = self.span(2, 20)
+        inner = self.span(5, 10)
+        fragments = renderer.fragmentize(self.file, [inner, outer])
+        self.assertEqual([frag.spans for frag in fragments],
+                         [(), (outer,), (outer, inner), (outer,), ()])
+
+    def test_equal_spans(self):
+        span_1 = self.span(2, 5)
+        span_2 = self.span(2, 5)
+        self.assertIsNot(span_1, span_2)
+        fragments = renderer.fragmentize(self.file, [span_1, span_2])
+        self.assertEqual([frag.spans for frag in fragments], [(), (span_1,), ()])
+        self.assertEqual(len(fragments[1].span_ids), 1)
+
+    def test_interned_span_added_twice(self):
+        span = self.span(2, 5)
+        fragments = renderer.fragmentize(self.file, [span, span], interned=True)
+        self.assertEqual([frag.spans for frag in fragments], [(), (span,), ()])
+
+
+class TestRenderer(TestCase):
+    def test_intern_span(self):
+        r = renderer._Renderer("foo")
+        span = r.intern_span(self.span(0, 10))
+        self.assertIs(r.intern_span(self.span(0, 10)), span)
+        self.assertIsNot(r.intern_span(self.span(0, 11)), span)
+
+
+if __name__ == '__main__':
+    unittest.main()